@@ -1,9 +1,7 @@
 # app.py
 import streamlit as st
-import vectorbt as vbt
 import yfinance as yf
 import pandas as pd
-import plotly.express as px
 import numpy as np
 
 # Initialize session state
@@ -36,7 +34,7 @@ st.sidebar.header("Portfolio Configuration")
 
 # Ticker input section
 st.sidebar.subheader("Ticker Selection")
-selected_tickers = []
+selected_tickers = {}  # insertion-ordered set of tickers
 
 # Create 5 ticker input boxes
 for i in range(5):
@@ -48,7 +46,7 @@ for i in range(5):
     ).strip().upper()
     
     if ticker:
-        selected_tickers.append(ticker)
+        selected_tickers[ticker] = None
         st.session_state.tickers[i] = ticker
     else:
         st.session_state.tickers[i] = ''
@@ -69,7 +67,9 @@ if 'prev_tickers' not in st.session_state or st.session_state.prev_tickers != cu
 
 # Weight adjustment functions
 def update_weight_from_slider(ticker):
-    st.session_state[f"text_{ticker}"] = st.session_state[f"slider_{ticker}"]
+    value = st.session_state[f"slider_{ticker}"]
+    st.session_state.weights[ticker] = value
+    st.session_state[f"text_{ticker}"] = f"{value:.1f}"
 
 def update_weight_from_text(ticker):
     try:
@@ -83,18 +83,50 @@ def update_weight_from_text(ticker):
     except:
         st.session_state[f"text_{ticker}"] = st.session_state.weights.get(ticker, 0)
 
-# Create weight controls for each selected ticker
+# numba is only imported the first time weights need rebalancing, and the
+# compiled kernel is kept for the life of the process rather than per rerun
+@st.cache_resource
+def _normalize_kernel():
+    from numba import njit
+
+    @njit(cache=True)
+    def _normalize(w):
+        s = w.sum()
+        if s > 0:
+            return w * (100.0 / s)
+        return np.full_like(w, 100.0 / len(w))
+
+    return _normalize
+
+def normalize_weights(weights):
+    values = _normalize_kernel()(np.array(list(weights.values()), dtype=np.float64))
+    return dict(zip(weights.keys(), values.tolist()))
+
 if selected_tickers:
+    # Auto-balance weights. This runs before the weight widgets are created,
+    # since Streamlit rejects writes to a widget's key once it is instantiated
     total_weight = sum(st.session_state.weights.values())
-    remaining_weight = 100 - total_weight
-    
+    if abs(total_weight - 100) > 0.1:
+        st.sidebar.warning(f"Total weight: {total_weight:.1f}% - Adjusting to 100%")
+        st.session_state.weights = normalize_weights(st.session_state.weights)
+        total_weight = 100.0
+
+    # Keep each text box and slider in step with its weight, writing only changed keys
+    for ticker in selected_tickers:
+        weight = st.session_state.weights[ticker]
+        text_value = f"{weight:.1f}"
+        if st.session_state.get(f"text_{ticker}") != text_value:
+            st.session_state[f"text_{ticker}"] = text_value
+        if st.session_state.get(f"slider_{ticker}") != weight:
+            st.session_state[f"slider_{ticker}"] = weight
+
+    # Create weight controls for each selected ticker
     for ticker in selected_tickers:
         col1, col2, col3 = st.sidebar.columns([3, 5, 2])
         with col1:
             st.write(f"**{ticker}**")  # Display ticker on the left
             st.text_input(
                 "%",
-                value=f"{st.session_state.weights.get(ticker, 0):.1f}",
                 key=f"text_{ticker}",
                 on_change=update_weight_from_text,
                 args=(ticker,),
@@ -105,7 +137,6 @@ if selected_tickers:
                 ticker,
                 min_value=0.0,
                 max_value=100.0,
-                value=float(st.session_state.weights.get(ticker, 0)),
                 step=0.1,
                 key=f"slider_{ticker}",
                 on_change=update_weight_from_slider,
@@ -114,17 +145,8 @@ if selected_tickers:
             )
         with col3:
             st.write("")
-
-    # Auto-balance weights
-    total_weight = sum(st.session_state.weights.values())
-    if abs(total_weight - 100) > 0.1:
-        st.sidebar.warning(f"Total weight: {total_weight:.1f}% - Adjusting to 100%")
-        for ticker in selected_tickers:
-            st.session_state.weights[ticker] = (st.session_state.weights[ticker] / total_weight) * 100
-            st.session_state[f"text_{ticker}"] = f"{st.session_state.weights[ticker]:.1f}"
-            st.session_state[f"slider_{ticker}"] = st.session_state.weights[ticker]
     
-    st.sidebar.metric("Total Weight", f"{sum(st.session_state.weights.values()):.1f}%")
+    st.sidebar.metric("Total Weight", f"{total_weight:.1f}%")
 
 # Date range selection
 st.sidebar.subheader("Backtest Parameters")
@@ -132,45 +154,90 @@ start_date = st.sidebar.date_input('Start Date', pd.to_datetime('2020-01-01'))
 end_date = st.sidebar.date_input('End Date', pd.to_datetime('today'))
 initial_capital = st.sidebar.number_input("Initial Capital ($)", 10000, 1000000, 100000)
 
+# Fetch data (keyed on tickers and dates so cached results are reused across reruns)
+@st.cache_data(ttl=3600)
+def load_data(tickers: tuple, start: str, end: str):
+    try:
+        df = yf.download(
+            list(tickers),
+            start=start,
+            end=end,
+            actions=False,
+            auto_adjust=True,
+            progress=False,
+        )['Close']
+        return df.dropna(axis=1, how='all')
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return None
+
+# Backtest (only pickleable results are cached, not the Portfolio object)
+def build_portfolio(tickers: tuple, weights: tuple, start: str, end: str, capital: float):
+    price_data = load_data(tickers, start, end)
+    weights = dict(weights)
+    return vbt.Portfolio.from_orders(
+        close=price_data,
+        size=[weights[ticker] for ticker in price_data.columns],
+        size_type='targetpercent',
+        cash_sharing=True,
+        group_by=True,
+        freq='D',
+        init_cash=capital,
+        call_seq='auto'
+    )
+
+@st.cache_data(ttl=3600)
+def run_backtest(tickers: tuple, weights: tuple, start: str, end: str, capital: float):
+    return build_portfolio(tickers, weights, start, end, capital).stats()
+
+@st.cache_data(ttl=3600)
+def plot_backtest(tickers: tuple, weights: tuple, start: str, end: str, capital: float):
+    portfolio = build_portfolio(tickers, weights, start, end, capital)
+    fig = portfolio.plot(subplots=['orders', 'trade_pnl', 'cum_returns'])
+    return go.Figure(fig)
+
+# Allocation chart (keyed on the weights so unchanged allocations reuse the figure)
+@st.cache_data(ttl=3600)
+def make_pie(items: tuple):
+    names, values = zip(*items)
+    return px.pie(
+        names=list(names),
+        values=list(values),
+        hole=0.3,
+        title="Portfolio Weight Distribution"
+    )
+
 # Main content area
 st.title("Portfolio Backtester")
 
 if selected_tickers:
+    # vectorbt and plotly are only imported once there is something to backtest
+    import vectorbt as vbt
+    import plotly.express as px
+    import plotly.graph_objects as go
+
     # Display portfolio composition
     st.header("Portfolio Allocation")
     weights = {k: v/100 for k, v in st.session_state.weights.items()}
-    fig = px.pie(
-        names=list(weights.keys()),
-        values=list(weights.values()),
-        hole=0.3,
-        title="Portfolio Weight Distribution"
-    )
-    st.plotly_chart(fig)
+    st.plotly_chart(make_pie(tuple(sorted(weights.items()))))
 
     # Fetch data
-    @st.cache_data
-    def load_data(tickers):
-        try:
-            df = yf.download(tickers, start=start_date, end=end_date)['Close']
-            return df.dropna(axis=1, how='all')
-        except Exception as e:
-            st.error(f"Error loading data: {str(e)}")
-            return None
-
-    price_data = load_data(selected_tickers)
+    price_data = load_data(
+        tuple(sorted(selected_tickers)),
+        start_date.isoformat(),
+        end_date.isoformat()
+    )
     
     if price_data is not None and not price_data.empty:
-        # Create portfolio
-        portfolio = vbt.Portfolio.from_orders(
-            close=price_data,
-            size=list(weights.values()),
-            size_type='targetpercent',
-            cash_sharing=True,
-            group_by=True,
-            freq='D',
-            init_cash=initial_capital,
-            call_seq='auto'
+        # Run backtest
+        backtest_args = (
+            tuple(sorted(selected_tickers)),
+            tuple(sorted(weights.items())),
+            start_date.isoformat(),
+            end_date.isoformat(),
+            initial_capital
         )
+        stats = run_backtest(*backtest_args)
 
         # Performance metrics
         st.header("Performance Analysis")
@@ -178,18 +245,24 @@ if selected_tickers:
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("Key Statistics")
-            stats = portfolio.stats()
             st.metric("Total Return", f"{stats['Total Return [%]']:.2f}%")
             st.metric("Sharpe Ratio", f"{stats['Sharpe Ratio']:.2f}")
             st.metric("Max Drawdown", f"{stats['Max Drawdown [%]']:.2f}%")
         
         with col2:
             st.subheader("Equity Curve")
-            fig = portfolio.plot(subplots=['orders', 'trade_pnl', 'cum_returns'])
-            st.plotly_chart(fig)
+            # The figure is only built when requested; it is the slowest part of the page
+            if st.checkbox("Show equity curve", value=False, key="show_equity_curve"):
+                st.plotly_chart(plot_backtest(*backtest_args))
 
         # Individual asset analysis
         st.header("Individual Asset Performance")
+        prices = price_data.ffill().to_numpy(dtype=np.float64)
+        returns = prices[1:] / prices[:-1] - 1.0
+        ann_returns = pd.Series((1 + np.nanmean(returns, axis=0))**252 - 1, index=price_data.columns)
+        ann_vols = pd.Series(np.nanstd(returns, axis=0, ddof=1) * np.sqrt(252), index=price_data.columns)
+        sharpes = ann_returns.div(ann_vols.where(ann_vols > 0)).fillna(0)
+
         for ticker in selected_tickers:
             with st.expander(f"{ticker} Analysis"):
                 col1, col2 = st.columns(2)
@@ -198,14 +271,9 @@ if selected_tickers:
                     st.line_chart(price_data[ticker])
                 with col2:
                     st.subheader("Metrics")
-                    returns = price_data[ticker].pct_change().dropna()
-                    ann_return = (1 + returns.mean())**252 - 1
-                    ann_vol = returns.std() * np.sqrt(252)
-                    sharpe = ann_return / ann_vol if ann_vol > 0 else 0
-                    
-                    st.metric("Annualized Return", f"{ann_return:.2%}")
-                    st.metric("Annualized Volatility", f"{ann_vol:.2%}")
-                    st.metric("Sharpe Ratio", f"{sharpe:.2f}")
+                    st.metric("Annualized Return", f"{ann_returns[ticker]:.2%}")
+                    st.metric("Annualized Volatility", f"{ann_vols[ticker]:.2%}")
+                    st.metric("Sharpe Ratio", f"{sharpes[ticker]:.2f}")
 
 else:
     st.warning("Please enter at least one ticker to begin analysis")